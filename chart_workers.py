@@ -0,0 +1,97 @@
+"""
+Process-pool entry points for chart rendering
+
+Kept out of streamlit_app.py for the same reason as pdf_workers: functions in
+the app script cannot be pickled into worker processes. Rendering uses the
+object-oriented Figure/Agg API only; nothing here touches pyplot's global
+figure manager, so renders never share state with other figures.
+"""
+import io
+from typing import Any, Dict, Tuple
+
+import matplotlib
+import matplotlib.style
+import numpy as np
+from matplotlib.figure import Figure
+
+# Color palette
+COLORS = ['#667eea', '#764ba2', '#f093fb', '#f5576c', '#4facfe', '#00f2fe']
+# Beyond these counts, per-point decorations (markers, value labels, every tick label) are unreadable
+MAX_MARKERS = 60
+MAX_BAR_LABELS = 40
+MAX_TICK_LABELS = 24
+
+
+def palette(n: int) -> list:
+    """n colors, cycling through the palette"""
+    return [COLORS[i % len(COLORS)] for i in range(n)]
+
+
+def render_chart(spec: Dict[str, Any], figsize: Tuple[float, float], dpi: int, fmt: str) -> bytes:
+    """Render a normalized chart spec to PNG or SVG bytes"""
+    chart_type, labels, values = spec["type"], spec["labels"], np.asarray(spec["values"], dtype=np.float64)
+    # Downsampled series keep their original row positions on the x axis
+    x = np.asarray(spec["positions"] if spec.get("positions") is not None else range(len(values)))
+
+    # Each worker renders one chart at a time, so the style context is private to this render.
+    # SVG keeps text as text rather than glyph outlines: far smaller for simple charts
+    with matplotlib.style.context('dark_background'), matplotlib.rc_context({'svg.fonttype': 'none'}):
+        fig = Figure(figsize=figsize)
+        fig.patch.set_facecolor('#1e1e1e')
+        ax = fig.add_subplot()
+        ax.set_facecolor('#2d2d2d')
+
+        # Create chart based on type
+        if chart_type == 'bar':
+            bars = ax.bar(x, values, color=palette(len(values)))
+            # Add value labels on bars
+            if len(values) <= MAX_BAR_LABELS:
+                for bar, value in zip(bars, values):
+                    height = bar.get_height()
+                    ax.text(bar.get_x() + bar.get_width()/2., height,
+                            f'{value:,.0f}', ha='center', va='bottom',
+                            color='white', fontweight='bold')
+
+        elif chart_type == 'line':
+            dense = len(values) > MAX_MARKERS
+            ax.plot(x, values, marker=None if dense else 'o', linewidth=1.5 if dense else 3,
+                    markersize=8, color='#667eea')
+            ax.fill_between(x, values, alpha=0.3, color='#667eea')
+
+        elif chart_type == 'pie':
+            wedges, texts, autotexts = ax.pie(values, labels=labels, colors=palette(len(values)),
+                                              autopct='%1.1f%%', startangle=90)
+            for autotext in autotexts:
+                autotext.set_color('white')
+                autotext.set_fontweight('bold')
+
+        elif chart_type == 'scatter':
+            dense = len(values) > MAX_MARKERS
+            ax.scatter(x, values, s=12 if dense else 100,
+                       c='#667eea' if dense else palette(len(values)), alpha=0.7)
+
+        else:
+            raise ValueError(f"Unsupported chart type: {chart_type}")
+
+        # Styling
+        ax.set_title(spec["title"], fontsize=16, fontweight='bold', color='#e0e0e0', pad=20)
+        ax.tick_params(colors='#e0e0e0')
+        ax.grid(True, alpha=0.3)
+
+        if chart_type != 'pie':
+            # Label at most MAX_TICK_LABELS evenly spaced points
+            ticks = np.unique(np.linspace(0, len(values) - 1, min(len(values), MAX_TICK_LABELS)).astype(int))
+            ax.set_xticks(x[ticks])
+            ax.set_xticklabels([labels[tick] for tick in ticks])
+            ax.set_xlabel('Categories', fontsize=12, color='#e0e0e0')
+            ax.set_ylabel('Values', fontsize=12, color='#e0e0e0')
+
+        ax.tick_params(axis='x', labelrotation=45)
+        for tick_label in ax.get_xticklabels():
+            tick_label.set_horizontalalignment('right')
+        fig.tight_layout()
+
+        img_buffer = io.BytesIO()
+        fig.savefig(img_buffer, format=fmt, dpi=dpi,
+                    bbox_inches='tight', facecolor='#1e1e1e')
+        return img_buffer.getvalue()
@@ -0,0 +1,32 @@
+"""
+Process-pool entry points for PDF extraction
+
+Kept out of streamlit_app.py on purpose: Streamlit executes the app script as
+__main__ on every rerun, so functions defined there cannot be pickled by
+reference into worker processes. This module imports nothing from Streamlit.
+"""
+import mmap
+import time
+from typing import List, Optional, Tuple
+
+import PyPDF2
+
+
+def extract_page_range(pdf_path: str, start: int, stop: int) -> List[Tuple[int, Optional[str], float]]:
+    """
+    Extract pages [start, stop) from the PDF stored at pdf_path
+    Each worker opens its own reader over a read-only mmap of the shared file;
+    returns (page_index, text or None on error, seconds) per page
+    """
+    results = []
+    with open(pdf_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as pdf_map:
+            pdf_reader = PyPDF2.PdfReader(pdf_map)
+            for page_index in range(start, stop):
+                started = time.perf_counter()
+                try:
+                    text = pdf_reader.pages[page_index].extract_text() or ""
+                except Exception:
+                    text = None
+                results.append((page_index, text, time.perf_counter() - started))
+    return results
@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# Shared caches and stores live under ARIA_CACHE_DIR; keep test runs out of the real one
+os.environ.setdefault("ARIA_CACHE_DIR", tempfile.mkdtemp(prefix="aria-tests-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from streamlit_app import load_chart_frame, lttb_downsample, minmax_downsample, select_chart_columns
+
+
+def test_pairs_frame():
+    frame, is_pairs = load_chart_frame("Q1,100|Q2, 150|junk|Q3,abc")
+    assert is_pairs
+    labels, values = select_chart_columns(frame, is_pairs)
+    assert list(labels) == ["Q1", "Q2", "Q3"]
+    assert list(values) == [100, 150, 0]  # non-numeric pair values count as 0
+
+
+@pytest.mark.parametrize("payload", [
+    '{"Q1": 100, "Q2": 150}',
+    '[{"quarter": "Q1", "sales": 100}, {"quarter": "Q2", "sales": 150}]',
+    "csv:\nquarter,sales\nQ1,100\nQ2,150",
+])
+def test_json_and_csv_frames(payload):
+    labels, values = select_chart_columns(*load_chart_frame(payload))
+    assert list(labels) == ["Q1", "Q2"]
+    assert list(values) == [100, 150]
+
+
+def test_named_dataset():
+    data = pd.DataFrame({"day": ["Mon", "Tue"], "name": ["a", "b"], "visits": [3, 4]})
+    frame, is_pairs = load_chart_frame("@traffic", {"traffic": data})
+    labels, values = select_chart_columns(frame, is_pairs)
+    assert list(labels) == ["Mon", "Tue"] and list(values) == [3, 4]  # the most numeric column
+    with pytest.raises(ValueError, match="No dataset named 'other'"):
+        load_chart_frame("@other", {"traffic": data})
+
+
+def test_lttb_keeps_endpoints_and_spikes():
+    values = np.zeros(10_000)
+    values[1234], values[8765] = 50.0, -50.0
+    selected = lttb_downsample(values, 200)
+    assert len(selected) == 200
+    assert selected[0] == 0 and selected[-1] == len(values) - 1
+    assert np.all(np.diff(selected) > 0)
+    assert {1234, 8765} <= set(selected.tolist())
+
+
+def test_lttb_returns_everything_below_the_threshold():
+    assert list(lttb_downsample(np.arange(5.0), 10)) == [0, 1, 2, 3, 4]
+    assert list(lttb_downsample(np.arange(5.0), 2)) == [0, 1, 2, 3, 4]
+
+
+def test_minmax_keeps_each_buckets_extremes():
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=1000)
+    values[321] = 100.0
+    selected = minmax_downsample(values, 100)
+    assert len(selected) <= 100
+    assert np.all(np.diff(selected) > 0)
+    assert 321 in selected and int(np.argmin(values)) in selected
+    for start in range(0, 1000, 20):
+        bucket = values[start:start + 20]
+        assert start + int(np.argmax(bucket)) in selected
+        assert start + int(np.argmin(bucket)) in selected
+
+
+def test_minmax_returns_everything_below_the_threshold():
+    assert list(minmax_downsample(np.arange(4.0), 8)) == [0, 1, 2, 3]
@@ -0,0 +1,23 @@
+import sys
+
+from streamlit.testing.v1 import AppTest
+
+import streamlit_app as app
+
+SVG = b'<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10"><rect width="10" height="10"/></svg>'
+
+
+def test_svg_charts_are_served_by_url():
+    chart_id = app.get_chart_asset_store().put(SVG, "image/svg+xml")
+    script = f"""
+import sys
+sys.path[:0] = {sys.path!r}
+import streamlit_app as app
+app.initialize_session_state()
+app.display_chart({chart_id!r}, "m0")
+"""
+    at = AppTest.from_string(script, default_timeout=60).run()
+    assert not at.exception
+    html, = [markdown.value for markdown in at.markdown]
+    assert html.startswith('<img src="/') and html.endswith('.svg" alt="Chart" style="width: 100%">')
+    assert "data:" not in html
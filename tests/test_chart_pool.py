@@ -0,0 +1,48 @@
+import os
+import signal
+
+import numpy as np
+import pytest
+
+import streamlit_app as app
+
+SPEC = app.normalize_chart_spec("Sales", "bar", ["Q1", "Q2", "Q3"], [100, 150, 120])
+
+
+def test_pool_recovers_after_worker_crash():
+    pool = app.ChartRenderPool(workers=1, max_queue=1, timeout=120)
+    try:
+        assert pool.render(SPEC, "preview", "png").startswith(b"\x89PNG")
+
+        for process in list(pool._executor._processes.values()):
+            os.kill(process.pid, signal.SIGKILL)
+
+        assert pool.render(SPEC, "preview", "png").startswith(b"\x89PNG")
+        stats = pool.stats()
+        assert stats["restarts"] == 1
+        assert stats["pending"] == 0
+    finally:
+        pool._executor.shutdown(wait=True)
+
+
+def test_timed_out_render_is_stopped_and_frees_its_slot():
+    slow = app.normalize_chart_spec("Slices", "pie", [str(i) for i in range(20_000)], [1] * 20_000)
+    pool = app.ChartRenderPool(workers=1, max_queue=0, timeout=1)
+    try:
+        with pytest.raises(TimeoutError):
+            pool.render(slow, "preview", "png")
+        pool.timeout = 120  # a fresh worker still has to start up
+        assert pool.render(SPEC, "preview", "png").startswith(b"\x89PNG")
+        stats = pool.stats()
+        assert (stats["timeouts"], stats["restarts"], stats["pending"]) == (1, 1, 0)
+    finally:
+        pool._executor.shutdown(wait=True)
+
+
+def test_long_category_lists_are_grouped():
+    labels = np.array(["a", "b", "c", "d", "e"], dtype=object)
+    values = np.array([5.0, 1.0, 4.0, 2.0, 3.0])
+    grouped_labels, grouped_values = app.group_chart_categories(labels, values, 3)
+    assert list(grouped_labels) == ["a", "c", "Other"]
+    assert list(grouped_values) == [5.0, 4.0, 6.0]
+    assert app.group_chart_categories(labels, values, 5)[0] is labels
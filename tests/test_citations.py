@@ -0,0 +1,78 @@
+from streamlit_app import (CitationFormatterTool, format_authors, format_bibliography, parse_bibtex,
+                           parse_citation_lines, parse_csl_json)
+
+BIBTEX = r"""@comment{not an entry}
+@article{smith2020,
+  author = {Smith, John and Doe, Jane A.},
+  title = {Deep {Learning} for \& Science},
+  journal = "Journal of AI",
+  year = 2020,
+  doi = {10.1000/XYZ}
+}
+@book{lee2019, author={Ann Lee}, title={Patterns}, publisher={Acme Press}, date={2019-05-01}}
+"""
+
+
+def test_parse_bibtex():
+    smith, lee = parse_bibtex(BIBTEX)
+    assert smith == {
+        "authors": [("Smith", "John"), ("Doe", "Jane A.")],
+        "title": "Deep Learning for & Science",
+        "year": "2020",
+        "source": "Journal of AI",
+        "url": "",
+        "doi": "10.1000/XYZ",
+    }
+    assert (lee["authors"], lee["year"], lee["source"]) == ([("Lee", "Ann")], "2019", "Acme Press")
+
+
+def test_parse_csl_json():
+    record, = parse_csl_json(
+        '[{"author": [{"family": "Smith", "given": "John"}, {"literal": "WHO"}], "title": "T",'
+        ' "issued": {"date-parts": [[2021, 3]]}, "container-title": ["Nature"], "DOI": "10.1/a"}]'
+    )
+    assert record["authors"] == [("Smith", "John"), ("WHO", "")]
+    assert (record["year"], record["source"], record["doi"]) == ("2021", "Nature", "10.1/a")
+    assert parse_csl_json('{"title": "Solo"}')[0]["year"] == ""
+
+
+def test_parse_citation_lines_skips_malformed_lines():
+    assert parse_citation_lines("Zed|B|2020|J\n\nnot a record") == [
+        {"author": "Zed", "title": "B", "year": "2020", "source": "J"}
+    ]
+
+
+def test_format_authors():
+    authors = [("Smith", "John"), ("Doe", "Jane A.")]
+    assert format_authors(authors, "APA") == "Smith, J., & Doe, J. A."
+    assert format_authors(authors, "Harvard") == "Smith, J. and Doe, J. A."
+    assert format_authors(authors, "MLA") == "Smith, John, and Jane A. Doe"
+    assert format_authors(authors + [("Lee", "Ann")], "MLA") == "Smith, John, et al"
+    assert format_authors(authors, "Chicago") == "Smith, John, and Jane A. Doe"
+
+
+def test_bibliography_is_deduplicated_by_doi_and_sorted():
+    records = parse_bibtex(BIBTEX)
+    duplicate = dict(records[0], title="Deep learning for science", doi="10.1000/xyz")
+    bibliography, removed = format_bibliography(records + [duplicate], ["APA", "MLA"], access_date="May 1, 2024")
+    assert removed == 1
+    assert bibliography["APA"] == [
+        "Lee, A. (2019). Patterns. Acme Press.",
+        "Smith, J., & Doe, J. A. (2020). Deep Learning for & Science. Journal of AI.",
+    ]
+    assert bibliography["MLA"][1] == 'Smith, John, and Jane A. Doe. "Deep Learning for & Science." Journal of AI, 2020.'
+
+
+def test_missing_fields_are_filled_and_cleaned():
+    bibliography, _ = format_bibliography(parse_csl_json('{"title": "Solo"}'), ["APA", "Harvard"],
+                                          access_date="May 1, 2024")
+    assert bibliography == {"APA": ["Anonymous (n.d.). Solo."], "Harvard": ["Anonymous n.d., 'Solo'."]}
+
+
+def test_batch_tool_sorts_by_year():
+    result = CitationFormatterTool().run(
+        "APA sort=year|@article{a, author={B, C}, title={X}, year={2001}, journal={J}}\n"
+        "@article{b, author={A, D}, title={Y}, year={2000}, journal={K}}"
+    )
+    assert result.index("A, D. (2000). Y. K.") < result.index("B, C. (2001). X. J.")
+    assert "• Input: 2 BibTeX entries" in result
@@ -0,0 +1,67 @@
+import pytest
+import streamlit as st
+
+from streamlit_app import DocumentLibrary, PDFReaderTool
+
+
+@pytest.fixture
+def library():
+    library = DocumentLibrary()
+    for name in ["report.pdf", "report_2023.pdf", "Annual Review.pdf", "notes.pdf"]:
+        library.documents[name] = None  # handles are not needed to resolve names
+    return library
+
+
+def test_exact_name_or_stem_beats_prefix(library):
+    assert library.match("report") == ["report.pdf"]
+    assert library.match("REPORT.PDF") == ["report.pdf"]
+    assert library.match("annual review") == ["Annual Review.pdf"]
+
+
+def test_unique_prefix_matches(library):
+    assert library.match("report_2") == ["report_2023.pdf"]
+    assert library.match("annual") == ["Annual Review.pdf"]
+
+
+def test_substrings_do_not_match(library):
+    assert library.match("port") == []
+    assert library.match("review") == []
+
+
+def test_select_reports_unmatched_and_ambiguous(library):
+    library.documents["notes_draft.pdf"] = None
+    selected, unmatched, ambiguous = library.select(["report", " notes_d ", "budget", "no", ""])
+    assert selected == ["report.pdf", "notes_draft.pdf"]
+    assert unmatched == ["budget"]
+    assert ambiguous == {"no": ["notes.pdf", "notes_draft.pdf"]}
+
+
+def test_select_defaults_to_every_document(library):
+    assert library.select() == (library.names(), [], {})
+
+
+def test_ambiguous_document_prefix_is_reported(library):
+    library.documents["notes_draft.pdf"] = None
+    st.session_state["pdf_library"] = library
+    try:
+        result = PDFReaderTool().run("no|key findings")
+    finally:
+        del st.session_state["pdf_library"]
+    assert result.startswith("❓ Ambiguous document name: 'no' could be notes.pdf, notes_draft.pdf")
+
+
+def test_pipe_in_a_question_is_not_a_document_prefix(library, monkeypatch):
+    searched = []
+    monkeypatch.setattr(library, "load", lambda name: (name,))
+    monkeypatch.setattr(PDFReaderTool, "_library_result",
+                        lambda self, query, loaded: searched.append((query, list(loaded))) or "")
+    monkeypatch.setattr(PDFReaderTool, "_single_document_result",
+                        lambda self, query, name: searched.append((query, [name])) or "")
+    st.session_state["pdf_library"] = library
+    try:
+        assert PDFReaderTool().run("ratio of x|y in the tables") == ""
+        notice = PDFReaderTool().run("report, budget|revenue")
+    finally:
+        del st.session_state["pdf_library"]
+    assert searched == [("ratio of x|y in the tables", library.names()), ("revenue", ["report.pdf"])]
+    assert notice.startswith("⚠️ No uploaded document matches: budget.")
@@ -0,0 +1,66 @@
+from typing import Any, Iterator
+
+from langchain_core.language_models.chat_models import BaseChatModel, generate_from_stream
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, SystemMessage
+from langchain_core.load import dumps as lc_dumps
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+import streamlit_app as app
+
+
+class StreamingFakeChat(BaseChatModel):
+    """Streams a fixed answer, like ChatGoogleGenerativeAI implementing _stream"""
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "streaming-fake"
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        self.calls += 1
+        for token in ["cached ", "answer"]:
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        return generate_from_stream(self._stream(messages, stop=stop, run_manager=run_manager, **kwargs))
+
+
+def make_cache(tmp_path, **kwargs):
+    return app.LLMResponseCache(path=str(tmp_path / "llm.sqlite3"), **kwargs)
+
+
+def test_agent_executor_serves_repeated_question_from_cache(tmp_path):
+    cache = make_cache(tmp_path)
+    llm = StreamingFakeChat(cache=cache)
+    runtime = app.AgentRuntime("test-key")
+    runtime.agent = app.create_parallel_functions_agent(llm, runtime.functions, runtime.prompt)
+    executor = runtime.bind(app.RollingSummaryMemory(memory_key="chat_history", return_messages=True,
+                                                     input_key="input", output_key="output"))
+
+    first = executor.invoke({"input": "What is a literature review?", "chat_history": []})
+    executor.memory.clear()
+    second = executor.invoke({"input": "What is a literature review?", "chat_history": []})
+
+    assert first["output"] == second["output"] == "cached answer"
+    assert llm.calls == 1
+    assert cache.stats()["hits"] == 1
+
+
+def prompt_for(question: str) -> str:
+    return lc_dumps([SystemMessage(content="You are ARIA"), HumanMessage(content=f"Query: {question}\n\nContext")])
+
+
+def test_ttl_follows_question_time_sensitivity(tmp_path):
+    cache = make_cache(tmp_path, ttl=86400)
+    assert cache.ttl_for(prompt_for("breaking news about chip export rules")) == app.SEARCH_CACHE_TTLS["realtime"]
+    assert cache.ttl_for(prompt_for("latest trends in battery storage")) == app.SEARCH_CACHE_TTLS["recent"]
+    assert cache.ttl_for(prompt_for("what is photosynthesis")) == 86400
+
+
+def test_expired_entries_are_not_served(tmp_path):
+    cache = make_cache(tmp_path)
+    prompt = prompt_for("today's weather in Oslo")
+    cache.update(prompt, "llm", [ChatGeneration(message=AIMessage(content="sunny"))])
+    assert cache.lookup(prompt, "llm")[0].message.content == "sunny"
+    cache._conn.execute("UPDATE llm_cache SET expires = 0")
+    assert cache.lookup(prompt, "llm") is None
@@ -0,0 +1,95 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain.schema import AIMessage, HumanMessage
+
+import streamlit_app as app
+
+
+def fold_summary(summary, messages):
+    return (summary + " " if summary else "") + " ".join(message.content for message in messages)
+
+
+def make_memory(**kwargs):
+    memory = app.RollingSummaryMemory(memory_key="chat_history", return_messages=True, input_key="input",
+                                      output_key="output", **kwargs)
+    memory.summarizer = fold_summary
+    memory.executor = ThreadPoolExecutor(max_workers=1)
+    return memory
+
+
+def wait_for_folds(memory, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while memory.stats()["folding"]:
+        assert time.monotonic() < deadline, "fold did not finish"
+        time.sleep(0.01)
+
+
+def chat(memory, turns):
+    for turn in range(turns):
+        memory.save_context({"input": f"question {turn}"}, {"output": f"answer {turn}"})
+        wait_for_folds(memory)
+
+
+def test_old_turns_fold_into_summary():
+    memory = make_memory(recent_turns=2)
+    chat(memory, 5)
+    assert "question 0" in memory.summary and "answer 2" in memory.summary
+    assert memory.stats()["verbatim_turns"] == 2
+    history = memory.load_memory_variables({})["chat_history"]
+    assert [message.content for message in history[2:]] == ["question 3", "answer 3", "question 4", "answer 4"]
+
+
+def test_history_alternates_after_summary():
+    memory = make_memory(recent_turns=1)
+    chat(memory, 3)
+    history = memory.load_memory_variables({})["chat_history"]
+    assert [type(message) for message in history] == [HumanMessage, AIMessage] * 2
+
+
+def test_history_respects_token_budget():
+    memory = make_memory(recent_turns=10, max_token_limit=100)
+    memory.executor = None  # no folding: only the load-time budget applies
+    for turn in range(10):
+        memory.save_context({"input": f"question {turn}"}, {"output": "word " * 40})
+    history = memory.load_memory_variables({})["chat_history"]
+    assert app.message_tokens(history) <= 100
+    assert history[-1].content.startswith("word")
+
+
+def test_oversized_latest_turn_is_truncated():
+    memory = make_memory(max_token_limit=50)
+    memory.executor = None
+    memory.save_context({"input": "question"}, {"output": "x" * 2000})
+    history = memory.load_memory_variables({})["chat_history"]
+    assert history[1].content.endswith("(truncated)")
+    assert app.message_tokens(history) <= 55
+
+
+def test_clear_drops_summary():
+    memory = make_memory(recent_turns=1)
+    chat(memory, 3)
+    memory.clear()
+    assert memory.summary == ""
+    assert memory.load_memory_variables({})["chat_history"] == []
+
+
+@pytest.mark.parametrize("profile", list(app.PROMPT_PROFILES))
+@pytest.mark.parametrize("convert_system_message", [True, False])
+def test_agent_prompt_with_folded_memory_builds_gemini_request(profile, convert_system_message):
+    memory = make_memory(recent_turns=3)
+    chat(memory, 5)
+    assert memory.summary
+
+    messages = app.CompiledPrompt(profile).template.format_messages(
+        input="next question", agent_scratchpad=[], **memory.load_memory_variables({})
+    )
+    llm = app.StreamingChatGoogleGenerativeAI(model="gemini-2.5-pro", google_api_key="test-key",
+                                              convert_system_message_to_human=convert_system_message)
+    request = llm._prepare_request(messages)
+
+    roles = [content.role for content in request.contents]
+    assert roles == ["user", "model"] * 4 + ["user"]
+    assert "Summary of our earlier conversation" in request.contents[0].parts[-1].text
+    assert ("system_instruction" in request) != convert_system_message
@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+import pytest
+
+import streamlit_app as app
+from streamlit_app import DocumentLibrary, PDFIngestionJob, PDFReaderTool, PDFTextCache, parse_page_request
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("pages 40-45", (40, 45)),
+    ("Page 12", (12, 12)),
+    ("pp. 7 to 9", (7, 9)),
+    ("pages 45–40", (40, 45)),
+    ("section starting at page 12", (12, None)),
+    ("page 0", (0, 0)),
+    ("what does the report say about pagers", None),
+])
+def test_parse_page_request(query, expected):
+    assert parse_page_request(query) == expected
+
+
+@pytest.fixture
+def running_document(tmp_path, monkeypatch):
+    """A library with one 10-page document whose first 3 pages have been extracted so far"""
+    text_cache = PDFTextCache(str(tmp_path))
+    text_cache.put_document("digest", 10)
+    job = PDFIngestionJob(SimpleNamespace(digest="digest"))
+    for page_index in range(3):
+        text_cache.put_page("digest", page_index, f"page  {page_index + 1}")
+        job._on_page(page_index, 10)
+    monkeypatch.setattr(app, "get_pdf_text_cache", lambda: text_cache)
+    monkeypatch.setattr(app, "get_pdf_ingestion_manager", lambda: SimpleNamespace(get=lambda digest: job))
+    library = DocumentLibrary()
+    library.documents["doc.pdf"] = SimpleNamespace(digest="digest")
+    return library
+
+
+def test_read_pages_while_ingesting(running_document):
+    assert running_document.read_pages("doc.pdf", 2, 3) == (10, [(2, "page 2"), (3, "page 3")])
+
+
+def test_pages_beyond_the_document_do_not_wait(running_document):
+    assert running_document.read_pages("doc.pdf", 11, 15) == (10, [])
+
+
+def test_page_zero_is_rejected(running_document):
+    with pytest.raises(ValueError):
+        running_document.read_pages("doc.pdf", 0, 2)
+    result = PDFReaderTool()._page_range_result(running_document, ["doc.pdf"], 0, 0)
+    assert result == "❌ There is no page 0: page numbers start at 1."
+
+
+def test_page_beyond_the_end_is_reported(running_document):
+    result = PDFReaderTool()._page_range_result(running_document, ["doc.pdf"], 12, None)
+    assert result == "❌ doc.pdf has 10 pages; page 12 is beyond the end of the document."
@@ -0,0 +1,62 @@
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+from streamlit.runtime.memory_uploaded_file_manager import MemoryUploadedFileManager
+from streamlit.runtime.uploaded_file_manager import UploadedFile, UploadedFileRec
+
+import streamlit_app as app
+from streamlit_app import PDFBlobStore
+
+DATA = b"%PDF-1.4 test document"
+
+
+def test_identical_uploads_share_one_file(tmp_path):
+    store = PDFBlobStore(str(tmp_path))
+    first, second = store.put(DATA), store.put(bytearray(DATA))
+    assert first.path == second.path
+    assert store.stats() == {"files": 1, "bytes": len(DATA), "referenced": 1, "evictions": 0}
+
+
+def test_unreferenced_files_are_evicted_beyond_the_budget(tmp_path):
+    store = PDFBlobStore(str(tmp_path), max_bytes=0)
+    handle = store.put(DATA)
+    assert os.path.exists(handle.path)
+    handle.release()
+    assert not os.path.exists(handle.path)
+    assert store.stats()["evictions"] == 1
+
+
+def test_put_never_returns_an_evicted_file(tmp_path):
+    store = PDFBlobStore(str(tmp_path), max_bytes=0)
+    stop = threading.Event()
+
+    def evict():
+        while not stop.is_set():
+            store._evict()
+
+    evictor = threading.Thread(target=evict)
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # interleave the threads as often as possible
+    evictor.start()
+    try:
+        for _ in range(500):
+            handle = store.put(DATA)
+            with handle.open_stream() as stream:
+                assert stream[:4] == b"%PDF"
+            handle.release()
+    finally:
+        stop.set()
+        evictor.join()
+        sys.setswitchinterval(switch_interval)
+
+
+def test_released_uploads_leave_the_uploaded_file_manager(monkeypatch):
+    manager = MemoryUploadedFileManager("/upload")
+    manager.add_file("session", UploadedFileRec("file-1", "doc.pdf", "application/pdf", DATA))
+    uploaded_file = UploadedFile(manager.get_files("session", ["file-1"])[0], None)
+    monkeypatch.setattr(app, "get_script_run_ctx",
+                        lambda: SimpleNamespace(uploaded_file_mgr=manager, session_id="session"))
+    app.release_uploaded_files([uploaded_file])
+    assert manager.get_files("session", ["file-1"]) == []
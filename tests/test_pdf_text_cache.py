@@ -0,0 +1,71 @@
+import os
+import threading
+import time
+
+from streamlit_app import PDFTextCache
+
+
+def add_document(cache, digest, pages=2, text="x" * 100):
+    cache.put_document(digest, pages)
+    for page_index in range(pages):
+        cache.put_page(digest, page_index, text)
+
+
+def age(cache, digest, seconds):
+    """Make a document look unused for the given time, on disk and in this process"""
+    meta_path = os.path.join(cache._doc_dir(digest), "meta.json")
+    then = time.time() - seconds
+    os.utime(meta_path, (then, then))
+    cache._touched[digest] = then
+
+
+def test_pages_survive_a_new_process(tmp_path):
+    add_document(PDFTextCache(str(tmp_path)), "a", text="page text")
+    cache = PDFTextCache(str(tmp_path))
+    assert cache.num_pages("a") == 2
+    assert cache.get_page("a", 1) == "page text"
+    assert cache.stats()["page_hits"] == 1
+
+
+def test_least_recently_used_documents_are_evicted_beyond_the_budget(tmp_path):
+    cache = PDFTextCache(str(tmp_path), max_bytes=660)  # three documents of 216 bytes fit
+    add_document(cache, "old")
+    add_document(cache, "used")
+    age(cache, "old", 3600)
+    age(cache, "used", 1800)
+    add_document(cache, "new")
+    assert cache.stats()["evictions"] == 0  # within budget so far
+    age(cache, "new", 600)
+
+    cache.put_document("newest", 2)
+    assert not os.path.exists(cache._doc_dir("old"))
+    assert cache.num_pages("old") is None
+    assert cache.get_page("used", 0) == "x" * 100
+    assert cache.stats()["evictions"] == 1
+
+
+def test_documents_in_use_are_not_evicted(tmp_path):
+    cache = PDFTextCache(str(tmp_path), max_bytes=0)
+    add_document(cache, "a")
+    add_document(cache, "b")
+    assert cache.get_page("a", 0) == "x" * 100
+    assert cache.stats()["evictions"] == 0
+
+
+def test_counters_are_exact_under_concurrency(tmp_path):
+    cache = PDFTextCache(str(tmp_path))
+    cache.put_document("a", 2)
+    cache.put_page("a", 0, "extracted")
+
+    def lookup():
+        for _ in range(2000):
+            cache.get_page("a", 0)
+            cache.get_page("a", 1)
+
+    threads = [threading.Thread(target=lookup) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = cache.stats()
+    assert (stats["page_hits"], stats["page_misses"]) == (8000, 8000)
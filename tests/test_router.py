@@ -0,0 +1,45 @@
+import pytest
+
+from streamlit_app import FastPathRouter, ROUTER_PHRASE_CONFIDENCE
+
+
+@pytest.fixture
+def router():
+    return FastPathRouter(min_confidence=0.9)
+
+
+@pytest.mark.parametrize("query, tool_input", [
+    ("Sales|bar|Q1,100|Q2,150", "Sales|bar|Q1,100|Q2,150"),
+    ("Create a bar chart with Q1,100|Q2,150|Q3,120", "Bar Chart|bar|Q1,100|Q2,150|Q3,120"),
+    ("Make a pie chart titled Market Share with A,30|B,70", "Market Share|pie|A,30|B,70"),
+    ("Create a line chart of revenue for 2020,100|2021,200", "Revenue|line|2020,100|2021,200"),
+    ("Format in APA style: Smith|AI Research|2024|Journal", "APA|Smith|AI Research|2024|Journal"),
+])
+def test_well_formed_requests_are_routed(router, query, tool_input):
+    route = router.route(query)
+    assert route is not None and route.tool_input == tool_input
+
+
+@pytest.mark.parametrize("query", [
+    "Create a bar chart with Q1,100|Q2,150|Q3,120 and explain the trend",
+    "Create a bar chart of sales from stores with A,1|B,2",
+    "Format in APA style: Smith|AI Research|last spring|Journal",
+    "What were the latest developments in AI?",
+])
+def test_requests_needing_the_agent_are_not_routed(router, query):
+    assert router.route(query) is None
+
+
+def test_phrase_scores_the_share_of_well_formed_pairs(router):
+    route = router._match("Create a bar chart with Q1,100|Q2,150|Q3,120 and explain the trend")
+    assert route.confidence == pytest.approx(ROUTER_PHRASE_CONFIDENCE * 2 / 3)
+    assert router._match("Sales|bar|Q1,100|oops").confidence == 0.5
+
+
+def test_stats_count_hits_and_near_misses(router):
+    router.route("Sales|bar|Q1,100|Q2,150")
+    router.route("Sales|bar|Q1,100|oops")
+    router.route("hello")
+    stats = router.stats()
+    assert (stats["queries"], stats["hits"], stats["near_misses"]) == (3, 1, 1)
+    assert stats["hits_by_tool"] == {"chart_maker": 1}
@@ -0,0 +1,27 @@
+import pytest
+
+from streamlit_app import SearchBackend
+
+
+class StaticSearch(SearchBackend):
+    label = "Static"
+
+    def __init__(self, results, **kwargs):
+        super().__init__(**kwargs)
+        self.results = results
+
+    def _fetch(self, query):
+        return self.results
+
+
+def test_backends_must_implement_fetch():
+    class Incomplete(SearchBackend):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_search_returns_fetched_results():
+    results = [{"title": "A", "body": "text", "href": "https://a.com"}]
+    assert StaticSearch(results).search("query") == results
@@ -0,0 +1,38 @@
+import pytest
+
+from streamlit_app import canonical_url, merge_ranked_results
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("http://www.Example.com/a/", "https://example.com/a"),
+    ("https://example.com/a?utm_source=x&b=2&a=1&fbclid=y", "https://example.com/a?a=1&b=2"),
+    ("https://example.com", "https://example.com/"),
+    ("https://example.com/a#section", "https://example.com/a"),
+    ("ftp://files.example.com/x", "ftp://files.example.com/x"),
+])
+def test_canonical_url(url, expected):
+    assert canonical_url(url) == expected
+
+
+def test_merge_deduplicates_and_ranks_shared_results_first():
+    first = [
+        {"title": "A", "href": "https://a.com/x?utm_medium=feed", "body": "short"},
+        {"title": "B", "href": "https://b.com"},
+    ]
+    second = [
+        {"title": "C", "href": "https://c.com"},
+        {"title": "A again", "href": "http://www.a.com/x/", "body": "a longer snippet"},
+    ]
+    merged = merge_ranked_results([first, second], k=60)
+    assert [result["title"] for result in merged] == ["A", "C", "B"]
+    top = merged[0]
+    assert top["matches"] == 2
+    assert top["body"] == "a longer snippet"
+    assert top["score"] == pytest.approx(1 / 61 + 1 / 62)
+    assert merged[1]["score"] == pytest.approx(1 / 61)
+
+
+def test_results_without_url_merge_by_title():
+    merged = merge_ranked_results([[{"title": "Only title"}], [{"title": "Only title"}]])
+    assert len(merged) == 1 and merged[0]["matches"] == 2
+